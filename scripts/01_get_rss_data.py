@@ -1,10 +1,36 @@
 import feedparser
-import json
+import orjson
 import os
 import requests
 import urllib.request
 import time
 
+def entry_to_item(entry):
+    """Function to convert a parsed feed entry into a JSON item, looking each field up once."""
+    if 'turbo_content' in entry:
+        content = entry['turbo_content']
+    elif 'content' in entry:
+        content = entry['content'][0].get('value')
+    else:
+        content = ''
+    
+    enclosures = entry.get('enclosures')
+    enclosure = {
+        "url": enclosures[0].get('href', ''),
+        "type": enclosures[0].get('type', '')
+    } if enclosures else None
+    
+    return {
+        "title": entry.get('title', ''),
+        "link": entry.get('link', ''),
+        "pubDate": entry.get('published', ''),
+        "author": entry.get('author', None),
+        "category": entry.get('category', None),
+        "description": entry.get('description', ''),
+        "content": content,
+        "enclosure": enclosure
+    }
+
 def parse_rss_to_json(feed_url, output_file_path, max_retries=3, retry_delay=5):
     # Set up headers to mimic a browser request
     headers = {
@@ -62,32 +88,16 @@ def parse_rss_to_json(feed_url, output_file_path, max_retries=3, retry_delay=5):
             "description": feed_content.feed.get('description', ''),
             "language": feed_content.feed.get('language', '')
         },
-        "items": []
+        # Converting an entry is a few dict lookups, so a single pass beats a worker pool
+        "items": [entry_to_item(entry) for entry in feed_content.entries]
     }
 
-    # Loop through each item in the feed and add it to the JSON
-    for entry in feed_content.entries:
-        item = {
-            "title": entry.get('title', ''),
-            "link": entry.get('link', ''),
-            "pubDate": entry.get('published', ''),
-            "author": entry.get('author', None),
-            "category": entry.get('category', None),
-            "description": entry.get('description', ''),
-            "content": entry.get('turbo_content', entry.get('content', [{'value': ''}])[0].get('value') if 'content' in entry else ''),
-            "enclosure": {
-                "url": entry.get('enclosures', [{}])[0].get('href', ''),
-                "type": entry.get('enclosures', [{}])[0].get('type', '')
-            } if entry.get('enclosures') else None
-        }
-        rss_feed["items"].append(item)
-
     # Create the directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
 
-    # Save the JSON string to a file
-    with open(output_file_path, 'w') as json_file:
-        json.dump(rss_feed, json_file, indent=4)
+    # Serialize to UTF-8 JSON bytes in one call and save them to a file
+    with open(output_file_path, 'wb') as json_file:
+        json_file.write(orjson.dumps(rss_feed, option=orjson.OPT_INDENT_2))
 
     print(f"RSS feed data saved to {output_file_path}")
     print(f"Number of items processed: {len(rss_feed['items'])}")
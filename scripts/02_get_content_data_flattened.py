@@ -1,13 +1,25 @@
+import asyncio
 import feedparser
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 import time
 import json
+import orjson
+import re
+import sys
+import hashlib
+import shelve
 import requests
-import urllib.request
 import argparse
+import importlib.util
+import tiktoken
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
 from datetime import datetime
-from openai import OpenAI
+from pathlib import Path
+from openai import AsyncOpenAI, RateLimitError
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -17,14 +29,45 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY not found in environment variables")
 
-# Initialize the OpenAI client
-client = OpenAI()
+# Initialize the async OpenAI client
+async_client = AsyncOpenAI()
 
-# Configuration
-feed_url = 'https://pythoninvest.com/rss-feed-612566707351.xml'
-output_file_path = 'data/news_feed_flattened.parquet'
-MAX_RETRIES = 3
-RETRY_DELAY = 5
+@dataclass(frozen=True, slots=True)
+class PipelineCfg:
+    """Configuration of a pipeline run, built once in main() and passed to the workers."""
+    feed_url: str = 'https://pythoninvest.com/rss-feed-612566707351.xml'
+    output_file_path: str = 'data/news_feed_flattened.parquet'
+    market_stats_file_path: str = 'data/news_feed_with_market_stats.parquet'  # Written by --with-market-stats
+    feed_cache_path: str = 'data/.feed_cache.json'  # ETag / Last-Modified of the last processed feed
+    llm_cache_path: str = 'data/llm_cache.db'  # Extracted news items per (entry link, content)
+    feed_timeout: tuple = (5, 30)  # (connect, read) seconds, so a hung server cannot stall the pipeline
+    model: str = "gpt-4o-mini"
+    max_retries: int = 3
+    # Client-side throttling, keep at or below the account's OpenAI rate limits
+    max_requests_per_minute: int = 500
+    max_tokens_per_minute: int = 200_000
+    seconds_to_pause_after_rate_limit_error: int = 15
+    # Reply size limit of the model; a truncated reply is invalid JSON and fails the whole request
+    max_output_tokens: int = 16_384
+    # Several entries are packed into one request to save on the requests-per-minute limit;
+    # extraction output is about as long as its input, so the token budget is kept at half the
+    # reply limit (leaving room for the JSON structure), and larger entries are split on
+    # paragraph breaks into parts that fit the budget
+    batch_size: int = 4
+    batch_token_budget: int = 8_000
+
+CONTENT_SPLIT_BOUNDARY = '<br /><br />'
+# First individual news block of an entry; the text before it (title, disclaimer and the
+# start/end dates of the articles) is the entry header, repeated in every part of a split entry
+FIRST_NEWS_BLOCK = 'NEWS SUMMARY for'
+PARQUET_ROWS_PER_GROUP = 64 * 1024  # Rows converted to Arrow and written at a time
+
+# Markdown code fences the model may wrap its JSON answer in
+FENCE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.M)
+
+# End date of an entry: individual news pattern, then market news pattern
+INDIVIDUAL_END_DATE = re.compile(r'End date for the articles: (\d{4}-\d{2}-\d{2})')
+MARKET_END_DATE = re.compile(r'before (\d{4}-\d{2}-\d{2})')
 
 # Set up headers to mimic a browser request
 headers = {
@@ -36,123 +79,296 @@ headers = {
     'Upgrade-Insecure-Requests': '1'
 }
 
-def llm(prompt, model="gpt-4o-mini"):
-    """Function to query the language model with retry mechanism."""
-    for attempt in range(MAX_RETRIES):
+# Shared HTTP session: reuses connections and sends the browser headers on every request
+SESSION = requests.Session()
+SESSION.headers.update(headers)
+
+def count_tokens(text, model):
+    """Function to count the tokens of a text with the model's tokenizer."""
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+async def llm_async(prompt, model, max_tokens):
+    """Function to send a single prompt to the language model."""
+    return await async_client.chat.completions.create(
+        model=model,
+        temperature=0.0,
+        max_tokens=max_tokens,
+        timeout=5*60,
+        response_format={"type": "json_object"},
+        messages=[{"role": "user", "content": prompt}]
+    )
+
+@dataclass
+class StatusTracker:
+    """Shared counters for the throttled request scheduler."""
+    num_tasks_in_progress: int = 0
+    num_tasks_failed: int = 0
+    num_rate_limit_errors: int = 0
+    time_of_last_rate_limit_error: float = 0.0
+
+@dataclass
+class APIRequest:
+    """A prompt waiting to be sent, plus its retry budget and outcome."""
+    task_id: int
+    prompt: str
+    token_consumption: int
+    attempts_left: int
+    result: object = None
+    elapsed: float = 0.0
+
+    async def call_api(self, cfg, retry_queue, status, progress):
+        """Send the prompt; on failure, back off and re-queue while attempts remain."""
+        start_time = time.time()
         try:
-            response = client.chat.completions.create(
-                model=model,
-                temperature=0.0,
-                timeout=5*60,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response
+            self.result = await llm_async(prompt=self.prompt, model=cfg.model, max_tokens=cfg.max_output_tokens)
         except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                print(f"Attempt {attempt + 1} failed. Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"Error: {e}")
-                return None
-
-def get_feed_content(feed_url):
-    """Function to fetch RSS feed content with fallback mechanisms."""
-    feed_content = None
-    
-    # Create a custom URL opener with headers for feedparser
-    opener = urllib.request.build_opener()
-    opener.addheaders = [(k, v) for k, v in headers.items()]
-    feedparser.USER_AGENT = headers['User-Agent']
-    
-    # First try with requests
+            if isinstance(e, RateLimitError):
+                status.time_of_last_rate_limit_error = time.time()
+                status.num_rate_limit_errors += 1
+            self.attempts_left -= 1
+            if self.attempts_left > 0:
+                delay = 2 ** (cfg.max_retries - self.attempts_left - 1)
+                print(f"Request {self.task_id} failed ({e}). Retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                retry_queue.put_nowait(self)
+                return
+            print(f"Error: request {self.task_id} failed after {cfg.max_retries} attempts: {e}")
+            status.num_tasks_failed += 1
+        self.elapsed = time.time() - start_time
+        status.num_tasks_in_progress -= 1
+        progress.update(1)
+
+def llm_cache_key(entry_link, content):
+    """Function to build the LLM cache key of a feed entry."""
+    return hashlib.sha1((entry_link + content).encode()).hexdigest()
+
+def result_position(result, batch_length):
+    """Function to get the batch position a result belongs to, or None if its id is not a valid position."""
     try:
-        response = requests.get(feed_url, headers=headers)
-        response.raise_for_status()
-        print("Feed content retrieved successfully")
-        
-        # Parse with feedparser using the raw content
-        feed = feedparser.parse(response.text)
-        if len(feed.entries) > 0:
-            entry = feed.entries[0]
-            if 'turbo_content' in entry:
-                feed_content = entry['turbo_content']
-            elif 'content' in entry:
-                feed_content = entry['content'][0]['value']
-            elif 'description' in entry:
-                feed_content = entry['description']
-            else:
-                feed_content = response.text
-    except Exception as e:
-        print(f"Error with requests approach: {str(e)}")
-    
-    # Try direct feedparser approach as fallback
-    if feed_content is None:
-        try:
-            print("Trying direct feedparser approach with custom headers...")
-            urllib.request.install_opener(opener)
-            feed = feedparser.parse(feed_url)
-            
-            if len(feed.entries) > 0:
-                entry = feed.entries[0]
-                if 'turbo_content' in entry:
-                    feed_content = entry['turbo_content']
-                elif 'content' in entry:
-                    feed_content = entry['content'][0]['value']
-                elif 'description' in entry:
-                    feed_content = entry['description']
-        except Exception as e:
-            print(f"Error with direct feedparser: {str(e)}")
-    
-    return feed_content
-
-def parse_feed_entries(feed_url, mode='all'):
-    """Function to parse entries from the RSS feed and return a DataFrame."""
-    # Create a custom URL opener with headers for feedparser
-    opener = urllib.request.build_opener()
-    opener.addheaders = [(k, v) for k, v in headers.items()]
-    feedparser.USER_AGENT = headers['User-Agent']
-    urllib.request.install_opener(opener)
+        position = int(result["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return position if 0 <= position < batch_length else None
+
+def split_content_header(content):
+    """Function to split HTML content into its header, up to the line of the first individual news block, and the rest."""
+    block_start = content.find(FIRST_NEWS_BLOCK)
+    if block_start == -1:
+        return '', content
+    # Cut at the line break before the block, so that the block keeps its opening tags
+    line_start = content.rfind('<br />', 0, block_start)
+    header_end = line_start + len('<br />') if line_start != -1 else block_start
+    return content[:header_end], content[header_end:]
+
+def split_content(content, cfg):
+    """Function to split oversized HTML content on paragraph breaks into parts under cfg.batch_token_budget.
+
+    Every part starts with the entry header, which holds the dates of the news blocks.
+    """
+    max_tokens = cfg.batch_token_budget
+    if count_tokens(content, cfg.model) <= max_tokens:
+        return [content]
+    header, body = split_content_header(content)
+    max_tokens -= count_tokens(header, cfg.model)
+    parts = []
+    current_pieces = []
+    current_tokens = 0
+    for piece in body.split(CONTENT_SPLIT_BOUNDARY):
+        piece_tokens = count_tokens(piece, cfg.model)
+        if current_pieces and current_tokens + piece_tokens > max_tokens:
+            parts.append(header + CONTENT_SPLIT_BOUNDARY.join(current_pieces))
+            current_pieces = []
+            current_tokens = 0
+        current_pieces.append(piece)
+        current_tokens += piece_tokens
+    if current_pieces:
+        parts.append(header + CONTENT_SPLIT_BOUNDARY.join(current_pieces))
+    return parts
+
+def batch_jobs(jobs, cfg):
+    """Function to group (job_id, content) pairs into batches bounded by count and input tokens."""
+    batch_size = cfg.batch_size
+    token_budget = cfg.batch_token_budget
+    batches = []
+    current_batch = []
+    current_tokens = 0
+    for job in jobs:
+        job_tokens = count_tokens(job[1], cfg.model)
+        if current_batch and (len(current_batch) >= batch_size or current_tokens + job_tokens > token_budget):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = 0
+        current_batch.append(job)
+        current_tokens += job_tokens
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+async def process_api_requests(prompts, cfg):
+    """Function to send prompts concurrently while staying under request and token rate limits.
+
+    Returns a list of (response, elapsed_seconds) tuples in the order of ``prompts``;
+    response is None for prompts that failed on every attempt.
+    """
+    max_requests_per_minute = cfg.max_requests_per_minute
+    max_tokens_per_minute = cfg.max_tokens_per_minute
+    # OpenAI counts the requested max_tokens against the tokens-per-minute limit, as well as the prompt
+    requests_to_send = [
+        APIRequest(task_id=i, prompt=prompt,
+                   token_consumption=count_tokens(prompt, cfg.model) + cfg.max_output_tokens,
+                   attempts_left=cfg.max_retries)
+        for i, prompt in enumerate(prompts)
+    ]
+    pending = deque(requests_to_send)
+    retry_queue = asyncio.Queue()
+    status = StatusTracker()
+    # Skip progress rendering when stderr is not a terminal (cron, CI, log files)
+    progress = tqdm(total=len(requests_to_send), desc="Processing entries", disable=not sys.stderr.isatty())
+
+    # Leaky buckets refilled continuously at the per-minute rate
+    available_request_capacity = max_requests_per_minute
+    available_token_capacity = max_tokens_per_minute
+    last_update_time = time.time()
+    next_request = None
+    in_flight = set()  # Hold task references so they are not garbage collected
+
+    while True:
+        if next_request is None:
+            if not retry_queue.empty():
+                next_request = retry_queue.get_nowait()
+            elif pending:
+                next_request = pending.popleft()
+                status.num_tasks_in_progress += 1
+
+        current_time = time.time()
+        seconds_since_update = current_time - last_update_time
+        available_request_capacity = min(
+            available_request_capacity + max_requests_per_minute * seconds_since_update / 60.0,
+            max_requests_per_minute
+        )
+        available_token_capacity = min(
+            available_token_capacity + max_tokens_per_minute * seconds_since_update / 60.0,
+            max_tokens_per_minute
+        )
+        last_update_time = current_time
+
+        if next_request is not None:
+            # Prompts larger than the whole bucket are sent once the bucket is full
+            tokens_needed = min(next_request.token_consumption, max_tokens_per_minute)
+            if available_request_capacity >= 1 and available_token_capacity >= tokens_needed:
+                available_request_capacity -= 1
+                available_token_capacity -= tokens_needed
+                task = asyncio.create_task(next_request.call_api(cfg, retry_queue, status, progress))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                next_request = None
+
+        if status.num_tasks_in_progress == 0:
+            break
+
+        await asyncio.sleep(0.001)
+
+        # Cool down for a while after hitting a rate limit
+        seconds_since_rate_limit_error = time.time() - status.time_of_last_rate_limit_error
+        if seconds_since_rate_limit_error < cfg.seconds_to_pause_after_rate_limit_error:
+            remaining_seconds_to_pause = cfg.seconds_to_pause_after_rate_limit_error - seconds_since_rate_limit_error
+            print(f"Rate limit hit, pausing for {remaining_seconds_to_pause:.1f} seconds...")
+            await asyncio.sleep(remaining_seconds_to_pause)
+
+    progress.close()
+    if status.num_rate_limit_errors:
+        print(f"{status.num_rate_limit_errors} rate limit errors received")
+    if status.num_tasks_failed:
+        print(f"{status.num_tasks_failed} of {len(requests_to_send)} requests failed")
+
+    return [(request.result, request.elapsed) for request in requests_to_send]
+
+def get_entry_content(entry):
+    """Function to get the HTML content of a feed entry, preferring turbo:content."""
+    if 'turbo_content' in entry:
+        return entry['turbo_content']
+    elif 'content' in entry:
+        return entry['content'][0]['value']
+    elif 'description' in entry:
+        return entry['description']
+    return None
+
+def load_feed_validators(cfg):
+    """Function to load the cached ETag / Last-Modified values for the feed."""
+    if not os.path.exists(cfg.feed_cache_path):
+        return {}
+    with open(cfg.feed_cache_path) as f:
+        return json.load(f).get(cfg.feed_url, {})
+
+def save_feed_validators(cfg, feed):
+    """Function to cache the ETag / Last-Modified values of a processed feed."""
+    feed_cache = {}
+    if os.path.exists(cfg.feed_cache_path):
+        with open(cfg.feed_cache_path) as f:
+            feed_cache = json.load(f)
+    feed_cache[cfg.feed_url] = {'etag': feed.get('etag'), 'modified': feed.get('modified')}
+    os.makedirs(os.path.dirname(cfg.feed_cache_path), exist_ok=True)
+    with open(cfg.feed_cache_path, 'w') as f:
+        json.dump(feed_cache, f, indent=4)
+
+def fetch_feed(cfg, conditional=True):
+    """Function to fetch and parse the RSS feed; returns None if it is unchanged (HTTP 304)."""
+    feed_url = cfg.feed_url
+    validators = load_feed_validators(cfg) if conditional else {}
+    conditional_headers = {}
+    if validators.get('etag'):
+        conditional_headers['If-None-Match'] = validators['etag']
+    if validators.get('modified'):
+        conditional_headers['If-Modified-Since'] = validators['modified']
     
     # First try with requests to get raw content
     try:
-        response = requests.get(feed_url, headers=headers)
+        response = SESSION.get(feed_url, headers=conditional_headers, timeout=cfg.feed_timeout)
+        if response.status_code == 304:
+            return None
         response.raise_for_status()
         print("Feed content retrieved successfully")
-        feed = feedparser.parse(response.text)
+        # Raw bytes let feedparser detect the encoding from the XML declaration itself
+        feed = feedparser.parse(response.content)
+        # Same keys feedparser fills in when it fetches the URL itself
+        feed['etag'] = response.headers.get('ETag')
+        feed['modified'] = response.headers.get('Last-Modified')
     except Exception as e:
         print(f"Error with requests approach: {str(e)}")
         print("Falling back to direct feedparser...")
-        feed = feedparser.parse(feed_url)
+        feed = feedparser.parse(
+            feed_url,
+            etag=validators.get('etag'),
+            modified=validators.get('modified'),
+            agent=headers['User-Agent'],
+            request_headers=headers
+        )
+        if feed.get('status') == 304:
+            return None
+    return feed
+
+async def parse_feed_entries_async(cfg, mode='all'):
+    """Function to parse entries from the RSS feed.
+
+    Returns the feed whose validators to save once the output is written ({} to forget
+    them, None when the feed is unchanged since the last run) and a DataFrame with the
+    news extracted from its entries.
+    """
+    # Only ask for a conditional response when the existing output covers the whole feed
+    feed = fetch_feed(cfg, conditional=mode != 'last' and os.path.exists(cfg.output_file_path))
+    if feed is None:
+        print(f"Feed not modified since the last run, reusing {cfg.output_file_path}")
+        return None, pd.read_parquet(cfg.output_file_path)
     
     # Process all entries first to get their dates
     all_entries_data = []
     for entry in feed.entries:
-        content = None
-        if 'turbo_content' in entry:
-            content = entry['turbo_content']
-        elif 'content' in entry:
-            content = entry['content'][0]['value']
-        elif 'description' in entry:
-            content = entry['description']
-        
+        content = get_entry_content(entry)
         if content:
-            # Look for date patterns in content
-            import re
-            # Pattern 1: Individual news pattern
-            date_pattern1 = r'End date for the articles: (\d{4}-\d{2}-\d{2})'
-            # Pattern 2: Market news pattern
-            date_pattern2 = r'before (\d{4}-\d{2}-\d{2})'
-            
-            match1 = re.search(date_pattern1, content)
-            match2 = re.search(date_pattern2, content)
-            
-            end_date = None
-            if match1:
-                end_date = match1.group(1)
-            elif match2:
-                end_date = match2.group(1)
-            
-            if end_date:
+            # Look for date patterns in content (the market pattern only if the individual one is missing)
+            match = INDIVIDUAL_END_DATE.search(content) or MARKET_END_DATE.search(content)
+            if match:
+                end_date = match.group(1)
                 all_entries_data.append((entry, end_date))
                 print(f"Found entry with date: {end_date}")
     
@@ -179,9 +395,10 @@ def parse_feed_entries(feed_url, mode='all'):
     
     prompt_template = '''Expert Web Scraper.
 
-HTML Content: {content}
+HTML Items: {items}
 
-Perform different types of text extraction:
+The HTML Items above are a JSON list of {{"id": <item_id>, "html": <HTML content>}} objects.
+Process EACH item separately and perform different types of text extraction on its HTML content:
 
 1) Extract individual news text AS IT IS from given HTML.
 
@@ -243,86 +460,180 @@ Output JSON format:
   ]
 }}
 
+Combine the extractions of every item into one JSON object keyed by item id:
+{{
+  "results": [
+    {{
+      "id": 0,                     // Use the item id from HTML Items
+      "content": [ ... ]           // All individual and market news objects extracted from that item
+    }},
+    // repeat for all items
+  ]
+}}
+
 Constraints:
 1. Return valid JSON only
 2. Use actual values from the content, not placeholders
 3. Ensure dates are in YYYY-MM-DD format
 4. Ensure numeric values (count, growth) are numbers, not strings
+5. Return exactly one "results" object for every item id, never mix news between items
 '''
     
-    for entry in tqdm(entries, desc="Processing entries"):
-        entry_start_time = time.time()
-        
-        # Extract content from entry
-        turbo_content = None
-        if 'turbo_content' in entry:
-            turbo_content = entry['turbo_content']
-        elif 'content' in entry:
-            turbo_content = entry['content'][0]['value']
-        elif 'description' in entry:
-            turbo_content = entry['description']
-        
+    # Collect (link, content) pairs first so the LLM calls can be scheduled together
+    jobs = []
+    for entry in entries:
+        turbo_content = get_entry_content(entry)
         if not turbo_content:
             print(f"No content found for entry {entry.get('link', 'unknown link')}")
             continue
             
-        print(f"\nProcessing entry with link: {entry.get('link', '')}")
+        print(f"\nQueued entry with link: {entry.get('link', '')}")
         print(f"Content length: {len(turbo_content)}")
         
-        entry_link = entry.get('link', '')
+        jobs.append((entry.get('link', ''), turbo_content))
+    
+    # Reuse cached extractions, published entries do not change
+    entry_contents = {}  # job index -> extracted news items
+    os.makedirs(os.path.dirname(cfg.llm_cache_path), exist_ok=True)
+    with shelve.open(cfg.llm_cache_path) as llm_cache:
+        cache_keys = [llm_cache_key(entry_link, content) for entry_link, content in jobs]
+        for job_index, key in enumerate(cache_keys):
+            if key in llm_cache:
+                entry_contents[job_index] = llm_cache[key]
         
-        prompt = prompt_template.format(content=turbo_content)
+        # Entries with identical content are sent once; the first entry of each group stands for all
+        content_groups = defaultdict(list)  # content hash -> job indices
+        for job_index, (_, content) in enumerate(jobs):
+            if job_index not in entry_contents:
+                content_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+                content_groups[content_hash].append(job_index)
+        pending = [(job_indices[0], part) for job_indices in content_groups.values()
+                   for part in split_content(jobs[job_indices[0]][1], cfg)]
+        expected_parts = Counter(job_index for job_index, _ in pending)
+        pending_jobs = {job_index for job_indices in content_groups.values() for job_index in job_indices}
+        print(f"Reusing cached extractions for {len(entry_contents)} entries, {len(pending_jobs)} left to process "
+              f"({len(content_groups)} with unique content)")
         
-        extracted_content_start_time = time.time()
-        extracted = llm(prompt=prompt)
-        extracted_content_end_time = time.time()
+        batches = batch_jobs(pending, cfg)
+        print(f"Packed {len(pending)} entry parts into {len(batches)} LLM requests")
         
-        if extracted is None:
-            continue
-            
-        try:
-            json_str = extracted.choices[0].message.content
-            json_str = json_str.replace("```json", "").replace("```", "")
-            data = json.loads(json_str)
+        extracted_start_time = time.time()
+        results = await process_api_requests([
+            prompt_template.format(items=json.dumps(
+                [{"id": i, "html": content} for i, (_, content) in enumerate(batch)]
+            ))
+            for batch in batches
+        ], cfg)
+        print(f"LLM extraction time for {len(pending_jobs)} entries: {time.time() - extracted_start_time:.2f}s")
+        
+        failed_jobs = set()
+        received_parts = Counter()  # job index -> parts extracted
+        for batch, (extracted, llm_time) in zip(batches, results):
+            batch_links = [jobs[job_index][0] for job_index, _ in batch]
+            if extracted is None:
+                failed_jobs.update(job_index for job_index, _ in batch)
+                continue
+                
+            try:
+                json_str = extracted.choices[0].message.content
+                data = orjson.loads(FENCE.sub('', json_str))
+                
+                # Group the results by batch position, ignoring ids that match no item
+                position_results = defaultdict(list)
+                for result in data.get("results", []):
+                    position = result_position(result, len(batch))
+                    if position is not None:
+                        position_results[position].append(result)
+                
+                # Fan the per-item results back out to their entries, merging the parts of
+                # entries that had to be split; an item without exactly one result has failed
+                for position, (job_index, _) in enumerate(batch):
+                    if len(position_results[position]) != 1:
+                        print(f"No single result for entry {jobs[job_index][0]} in the LLM response")
+                        failed_jobs.add(job_index)
+                        continue
+                    items = position_results[position][0].get("content", [])
+                    for item in items:
+                        item["link"] = jobs[job_index][0]
+                    entry_contents.setdefault(job_index, []).extend(items)
+                    received_parts[job_index] += 1
+            except Exception as e:
+                print(f"Error processing entries {batch_links}: {e}")
+                failed_jobs.update(job_index for job_index, _ in batch)
+                continue
             
-            if "content" in data:
-                for item in data["content"]:
-                    item["link"] = entry_link
-                all_content.extend(data["content"])
-        except Exception as e:
-            print(f"Error processing entry: {e}")
-            continue
+            print(f"LLM extraction time for {len(batch)} entry parts: {llm_time:.2f}s")
+        
+        # An entry split into parts has failed unless every one of its parts was extracted;
+        # drop the items of failed entries so that the output never holds a partial entry
+        failed_jobs.update(job_index for job_index, part_count in expected_parts.items()
+                           if received_parts[job_index] != part_count)
+        for job_index in failed_jobs:
+            entry_contents.pop(job_index, None)
+        
+        # Copy the extraction of each group's first entry to its duplicates, with their own links
+        for leader, *duplicates in content_groups.values():
+            for job_index in duplicates:
+                if leader in failed_jobs:
+                    failed_jobs.add(job_index)
+                elif leader in entry_contents:
+                    entry_contents[job_index] = [
+                        {**item, "link": jobs[job_index][0]} for item in entry_contents[leader]
+                    ]
         
-        entry_end_time = time.time()
-        print(f"Time for entry: {entry_end_time - entry_start_time:.2f}s, "
-              f"LLM extraction time: {extracted_content_end_time - extracted_content_start_time:.2f}s")
+        # Cache only entries whose every part was extracted
+        for job_index in pending_jobs - failed_jobs:
+            if job_index in entry_contents:
+                llm_cache[cache_keys[job_index]] = entry_contents[job_index]
+    
+    # Keep the feed order of the entries
+    for job_index in range(len(jobs)):
+        all_content.extend(entry_contents.get(job_index, []))
 
     # Convert to DataFrame and process market data
     df = pd.DataFrame(all_content)
     
-    # Convert growth to growth_last_day and divide by 100
+    # Convert growth to growth_last_day and divide by 100 (in place, NaNs propagate)
     if 'growth' in df.columns:
-        df['growth_last_day'] = df['growth'].apply(lambda x: x/100 if pd.notnull(x) else x)
-        df = df.drop('growth', axis=1)
+        df['growth_last_day'] = df.pop('growth') / 100
     
     total_end_time = time.time()
     print(f"Total time for parsing all entries: {total_end_time - total_start_time:.2f}s")
     
-    return df
+    # Remember this version of the feed only when the output will hold all of its entries;
+    # otherwise forget it so that the next run processes the feed in full again
+    is_complete = mode != 'last' and not failed_jobs
+    return (feed if is_complete else {}), df
 
-def main():
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='Process RSS feed data with different modes')
-    parser.add_argument('--mode', type=str, choices=['last', 'new', 'all'], default='all',
-                      help='Processing mode: last (only latest entry), new (append new entries), all (process all entries)')
-    args = parser.parse_args()
-    
+def write_parquet(df, path, rows_per_group=PARQUET_ROWS_PER_GROUP):
+    """Function to write a DataFrame to Parquet one row group at a time to cap peak memory."""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(path, schema, compression='snappy', use_dictionary=True) as writer:
+        for start in range(0, len(df), rows_per_group):
+            chunk = df.iloc[start:start + rows_per_group]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def parse_feed_entries(cfg, mode='all'):
+    """Function to run the async feed parser to completion."""
+    return asyncio.run(parse_feed_entries_async(cfg, mode=mode))
+
+def load_market_stats_module():
+    """Function to import 03_add_market_stats.py, whose file name is not a valid module name."""
+    path = Path(__file__).with_name('03_add_market_stats.py')
+    spec = importlib.util.spec_from_file_location('add_market_stats', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_pipeline(cfg, mode='all', with_market_stats=False):
+    """Function to build the flattened dataset and optionally add market metrics in memory."""
     main_start_time = time.time()
+    output_file_path = cfg.output_file_path
     
     # Get new data with specified mode
-    new_df = parse_feed_entries(feed_url, mode=args.mode)
+    feed, new_df = parse_feed_entries(cfg, mode=mode)
     
-    if args.mode == 'new' and os.path.exists(output_file_path):
+    if mode == 'new' and os.path.exists(output_file_path):
         # Append new entries to existing data
         existing_df = pd.read_parquet(output_file_path)
         print(f"Found existing data with {len(existing_df)} entries")
@@ -341,17 +652,39 @@ def main():
     else:
         print(f"Processing {len(new_df)} entries")
     
-    # Save to Parquet file with Brotli compression
+    # Save to Parquet file with Snappy compression (fast to write and to read back);
+    # it is also the base that the next --mode new run appends to
     save_start_time = time.time()
     os.makedirs("data", exist_ok=True)
-    new_df.to_parquet(output_file_path, compression="brotli")
+    write_parquet(new_df, output_file_path)
     save_end_time = time.time()
     
     print(f"Data saved to {output_file_path}. Save time: {save_end_time - save_start_time:.2f}s")
     print(f"Final dataset contains {len(new_df)} entries")
     
+    # Only now that the output is written may the next run skip this version of the feed
+    if feed is not None:
+        save_feed_validators(cfg, feed)
+    
+    if with_market_stats:
+        # Hand the in-memory DataFrame straight to the market stats step instead of reading it back
+        market_stats = load_market_stats_module()
+        enhanced_df = market_stats.attach_market_metrics(new_df.copy())
+        market_stats.save_enhanced_dataset(enhanced_df, cfg.market_stats_file_path)
+    
     main_end_time = time.time()
     print(f"Total execution time: {main_end_time - main_start_time:.2f}s")
 
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Process RSS feed data with different modes')
+    parser.add_argument('--mode', type=str, choices=['last', 'new', 'all'], default='all',
+                      help='Processing mode: last (only latest entry), new (append new entries), all (process all entries)')
+    parser.add_argument('--with-market-stats', action='store_true',
+                      help='Also add market metrics (same as running 03_add_market_stats.py afterwards)')
+    args = parser.parse_args()
+    
+    run_pipeline(PipelineCfg(), mode=args.mode, with_market_stats=args.with_market_stats)
+
 if __name__ == "__main__":
     main()
@@ -1,146 +1,158 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta
-from tqdm import tqdm
 import warnings
 import sys
 import traceback
 import logging
 
-# Set up logging
-logging.basicConfig(
-    filename='market_stats.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# yfinance emits pandas FutureWarnings on every download; silence them once instead of per call
+warnings.simplefilter("ignore", FutureWarning)
+
+# Per-ticker download errors go to this logger; silent unless the caller configures logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 # Configuration
 input_file_path = 'data/news_feed_flattened.parquet'
 output_file_path = 'data/news_feed_with_market_stats.parquet'
+MAX_DOWNLOAD_WORKERS = 16  # Parallel per-ticker downloads for tickers the batch request missed
+DAY_KEY_SPAN = 1 << 32  # Sort key multiplier that keeps each ticker's days in their own range
+PARQUET_ROWS_PER_GROUP = 64 * 1024  # Rows converted to Arrow and written at a time
+MARKET_COLS = ['weekly_return', 'market_daily_return', 'market_weekly_return', 'growth_above_market']
+
+def download_missing_history(tickers, start_date, end_date):
+    """Download closing prices ticker by ticker in parallel, skipping tickers that fail."""
+    closes = {}
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        futures = {
+            executor.submit(yf.Ticker(ticker).history, start=start_date, end=end_date): ticker
+            for ticker in tickers
+        }
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                hist = future.result()
+            except Exception as e:
+                logger.warning("Error downloading data for %s: %s", ticker, e)
+                continue
+            if not hist.empty:
+                closes[ticker] = hist['Close'].tz_localize(None)
+    return pd.DataFrame(closes)
+
+def compute_returns(obs_key, obs_close, ticker_start, query_ticker, query_day):
+    """Daily and weekly (5 trading days) returns as of the last trading day on or before each query day.
+
+    Observations are sorted by key ticker * DAY_KEY_SPAN + day; returns are NaN where the
+    ticker has no trading day on or before the query day, or not enough history before it.
+    """
+    position = np.searchsorted(obs_key, query_ticker * DAY_KEY_SPAN + query_day, side='right') - 1
+    first_position = ticker_start[query_ticker]
+    found = position >= first_position
+    
+    def period_return(periods):
+        base = position - periods
+        valid = found & (base >= first_position)
+        returns = np.full(len(position), np.nan)
+        returns[valid] = obs_close[position[valid]] / obs_close[base[valid]] - 1
+        return returns
+    
+    return period_return(1), period_return(5)
 
 def calculate_market_metrics(df):
-    """Calculate market metrics for all tickers in bulk."""
+    """Calculate market metrics for all tickers in bulk.
+
+    Expects end_date to be a timezone-naive datetime column (see attach_market_metrics).
+    """
     # Get unique tickers and date ranges
     tickers = df[df['type'] == 'individual']['ticker'].unique().tolist()
     tickers.append('^GSPC')  # Add S&P 500
     
-    # Convert dates to datetime and localize to UTC
-    df['end_date'] = pd.to_datetime(df['end_date']).dt.tz_localize(None)
-    
     # Get date range
     start_date = df['end_date'].min() - timedelta(days=10)  # Extra days for weekly calc
     end_date = df['end_date'].max() + timedelta(days=1)
     
     print(f"Downloading historical data for {len(tickers)} tickers")
     
-    # Download historical data for all tickers at once
-    all_history = {}
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", FutureWarning)
-        for ticker in tqdm(tickers, desc="Downloading ticker data"):
-            try:
-                ticker_obj = yf.Ticker(ticker)
-                hist = ticker_obj.history(start=start_date, end=end_date)
-                if not hist.empty:
-                    all_history[ticker] = hist
-            except Exception as e:
-                print(f"Error downloading data for {ticker}: {str(e)}")
+    # Download historical data for all tickers in one threaded batch request
+    close = pd.DataFrame()
+    try:
+        prices = yf.download(
+            tickers=tickers,
+            start=start_date,
+            end=end_date,
+            group_by='ticker',
+            auto_adjust=True,  # Match the adjusted prices of Ticker.history()
+            threads=True,
+            progress=False
+        )
+        if not isinstance(prices.columns, pd.MultiIndex):
+            prices = pd.concat({tickers[0]: prices}, axis=1)
+        # One column of closing prices per ticker, indexed by trading day
+        close = prices.xs('Close', level=1, axis=1).dropna(axis=1, how='all')
+        close.index = close.index.tz_localize(None)
+    except Exception as e:
+        print(f"Error downloading data for {len(tickers)} tickers: {str(e)}")
     
-    # Calculate returns for each ticker
-    returns_data = []
-    for ticker, hist in all_history.items():
-        # Calculate daily and weekly returns for each date
-        for date in pd.to_datetime(df['end_date'].unique()):
-            try:
-                # Convert hist index to UTC for comparison
-                hist_index = hist.index.tz_localize(None)
-                # Get relevant prices
-                date_idx = hist_index.get_indexer([date], method='ffill')[0]
-                if date_idx < 0 or date_idx >= len(hist):
-                    continue
-                
-                end_price = hist['Close'].iloc[date_idx]
-                
-                # Daily return
-                if date_idx > 0:
-                    start_price_daily = hist['Close'].iloc[date_idx-1]
-                    daily_return = (end_price - start_price_daily) / start_price_daily
-                else:
-                    daily_return = None
-                
-                # Weekly return (5 trading days)
-                if date_idx >= 5:
-                    start_price_weekly = hist['Close'].iloc[date_idx-5]
-                    weekly_return = (end_price - start_price_weekly) / start_price_weekly
-                else:
-                    weekly_return = None
-                
-                returns_data.append({
-                    'ticker': ticker,
-                    'date': date,
-                    'daily_return': daily_return,
-                    'weekly_return': weekly_return
-                })
-            except Exception as e:
-                print(f"Error calculating returns for {ticker} on {date}: {str(e)}")
+    # Retry tickers missing from the batch one by one for per-ticker error reporting
+    missing_tickers = [ticker for ticker in tickers if ticker not in close.columns]
+    if missing_tickers:
+        print(f"Retrying {len(missing_tickers)} tickers individually")
+        missing_close = download_missing_history(missing_tickers, start_date, end_date)
+        if not missing_close.empty:
+            close = pd.concat([close, missing_close], axis=1).sort_index()
+    print(f"Downloaded data for {close.shape[1]} of {len(tickers)} tickers")
     
-    # Convert to DataFrame and pivot for easier joining
-    returns_df = pd.DataFrame(returns_data)
+    # Flatten prices into sorted structure-of-arrays: one (ticker code, day, close)
+    # observation per trading day of each ticker, ordered by ticker then day
+    ticker_codes = {ticker: code for code, ticker in enumerate(close.columns)}
+    observations = close.stack(future_stack=True).dropna()
+    obs_ticker = observations.index.get_level_values(1).map(ticker_codes).to_numpy(np.int64)
+    obs_day = observations.index.get_level_values(0).to_numpy('datetime64[D]').astype(np.int64)
+    order = np.lexsort((obs_day, obs_ticker))
+    obs_key = obs_ticker[order] * DAY_KEY_SPAN + obs_day[order]
+    obs_close = observations.to_numpy(np.float64)[order]
+    # First observation of each ticker; the extra code len(ticker_codes) marks unknown tickers
+    ticker_start = np.searchsorted(obs_ticker[order], np.arange(len(ticker_codes) + 1))
     
-    # Calculate market metrics more efficiently using unique combinations
+    # Calculate market metrics for unique (date, ticker) combinations
     unique_combinations = df[['end_date', 'ticker', 'type']].drop_duplicates()
-    market_metrics = []
-    
-    for _, row in unique_combinations.iterrows():
-        date = pd.to_datetime(row['end_date'])
-        ticker = row['ticker'] if row['type'] == 'individual' else 'multiple_tickers'
-        
-        # Get market returns for this date
-        market_data = returns_df[
-            (returns_df['date'] == date) & 
-            (returns_df['ticker'] == '^GSPC')
-        ]
-        market_data = market_data.iloc[0] if not market_data.empty else pd.Series()
-        
-        # Get ticker returns for individual stocks
-        if ticker != 'multiple_tickers':
-            ticker_data = returns_df[
-                (returns_df['date'] == date) & 
-                (returns_df['ticker'] == ticker)
-            ]
-            ticker_data = ticker_data.iloc[0] if not ticker_data.empty else pd.Series()
-            
-            weekly_return = ticker_data.get('weekly_return')
-            market_weekly_return = market_data.get('weekly_return')
-            growth_above_market = (
-                weekly_return - market_weekly_return 
-                if weekly_return is not None and market_weekly_return is not None 
-                else None
-            )
-        else:
-            # For non-individual entries (multiple_tickers), use market returns for all metrics
-            weekly_return = market_data.get('weekly_return')
-            market_weekly_return = market_data.get('weekly_return')
-            growth_above_market = None  # No growth above market since it is the market
-        
-        market_metrics.append({
-            'date': date,
-            'ticker': ticker,
-            'weekly_return': weekly_return,
-            'market_daily_return': market_data.get('daily_return'),
-            'market_weekly_return': market_data.get('weekly_return'),
-            'growth_above_market': growth_above_market
-        })
-    
-    return pd.DataFrame(market_metrics)
-
-def main():
-    print(f"Reading data from {input_file_path}")
-    df = pd.read_parquet(input_file_path)
-    # Ensure end_date is datetime
-    df['end_date'] = pd.to_datetime(df['end_date'])
-    print(f"Loaded {len(df)} entries")
+    is_individual = (unique_combinations['type'] == 'individual').to_numpy()
+    query_day = unique_combinations['end_date'].to_numpy('datetime64[D]').astype(np.int64)
+    query_ticker = unique_combinations['ticker'].map(ticker_codes).fillna(len(ticker_codes)).to_numpy(np.int64)
+    market_ticker = np.full(len(query_day), ticker_codes.get('^GSPC', len(ticker_codes)))
+    
+    _, ticker_weekly = compute_returns(obs_key, obs_close, ticker_start, query_ticker, query_day)
+    market_daily, market_weekly = compute_returns(obs_key, obs_close, ticker_start, market_ticker, query_day)
     
+    # For non-individual entries (multiple_tickers), use market returns for all metrics;
+    # there is no growth above market since it is the market
+    return pd.DataFrame({
+        'date': unique_combinations['end_date'].to_numpy(),
+        'ticker': np.where(is_individual, unique_combinations['ticker'], 'multiple_tickers'),
+        'weekly_return': np.where(is_individual, ticker_weekly, market_weekly),
+        'market_daily_return': market_daily,
+        'market_weekly_return': market_weekly,
+        'growth_above_market': np.where(is_individual, ticker_weekly - market_weekly, np.nan)
+    })
+
+def write_parquet(df, path, rows_per_group=PARQUET_ROWS_PER_GROUP):
+    """Write a DataFrame to Parquet one row group at a time to cap peak memory."""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(path, schema, compression='snappy', use_dictionary=True) as writer:
+        for start in range(0, len(df), rows_per_group):
+            chunk = df.iloc[start:start + rows_per_group]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def attach_market_metrics(df):
+    """Function to calculate market metrics for the flattened news DataFrame and merge them in."""
+    # Parse end_date once into a timezone-naive datetime, as used by all later steps
+    df['end_date'] = pd.to_datetime(df['end_date'], utc=True).dt.tz_convert(None)
+
     # Calculate market metrics
     print("Calculating market metrics...")
     market_metrics = calculate_market_metrics(df)
@@ -150,10 +162,6 @@ def main():
     print(f"Original DataFrame shape: {df.shape}")
     print(f"Market metrics DataFrame shape: {market_metrics.shape}")
     
-    # Ensure date columns are in the same timezone-naive format
-    market_metrics['date'] = pd.to_datetime(market_metrics['date']).dt.tz_localize(None)
-    df['end_date'] = pd.to_datetime(df['end_date']).dt.tz_localize(None)
-    
     # Debug info before merge
     print("\nSample dates from original DataFrame:")
     print(df['end_date'].head())
@@ -179,15 +187,10 @@ def main():
     print("\nMerging market metrics with original data...")
     
     # Ensure we only merge the market metrics columns we need
-    market_metrics_subset = market_metrics[[
-        'date', 'ticker', 
-        'weekly_return', 'market_daily_return', 
-        'market_weekly_return', 'growth_above_market'
-    ]]
+    market_metrics_subset = market_metrics[['date', 'ticker'] + MARKET_COLS]
     
     # Drop existing market metrics columns if they exist
-    columns_to_drop = ['weekly_return', 'market_daily_return', 'market_weekly_return', 'growth_above_market']
-    df = df.drop(columns=[col for col in columns_to_drop if col in df.columns])
+    df = df.drop(columns=[col for col in MARKET_COLS if col in df.columns])
 
     # Merge with market metrics
     df = pd.merge(
@@ -200,14 +203,16 @@ def main():
     
     print(f"\nMerged DataFrame shape: {df.shape}")
     print("Columns in merged DataFrame:", df.columns.tolist())
-    
+    return df
+
+def save_enhanced_dataset(df, path=output_file_path):
+    """Function to verify the market metrics columns and save the enhanced dataset."""
     print(f"\nEnhanced DataFrame shape: {df.shape}")
     print("Columns in enhanced DataFrame:", df.columns.tolist())
     
     # Verify market metrics columns exist and have data
     print("\nVerifying market metrics before saving:")
-    market_cols = ['weekly_return', 'market_daily_return', 'market_weekly_return', 'growth_above_market']
-    for col in market_cols:
+    for col in MARKET_COLS:
         if col in df.columns:
             non_null_count = df[col].count()
             print(f"{col}: {non_null_count} non-null values out of {len(df)} rows")
@@ -218,19 +223,26 @@ def main():
     print("\nAll columns in DataFrame:", sorted(df.columns.tolist()))
     
     # Save enhanced dataset only if market metrics columns exist
-    if all(col in df.columns for col in market_cols):
-        print(f"\nSaving enhanced dataset to {output_file_path}")
-        df.to_parquet(output_file_path, compression="brotli")
+    if all(col in df.columns for col in MARKET_COLS):
+        print(f"\nSaving enhanced dataset to {path}")
+        write_parquet(df, path)
         print(f"Saved {len(df)} entries with market metrics")
     else:
         raise ValueError("Market metrics columns are missing from the DataFrame!")
+
+def main():
+    print(f"Reading data from {input_file_path}")
+    df = pd.read_parquet(input_file_path)
+    print(f"Loaded {len(df)} entries")
+    
+    df = attach_market_metrics(df)
+    save_enhanced_dataset(df)
     
     # Print sample of the data to verify
     print("\nSample of the enhanced data:")
     print(df[['ticker', 'end_date']].head())
     print("\nMarket metrics columns:")
-    market_cols = ['weekly_return', 'market_daily_return', 'market_weekly_return', 'growth_above_market']
-    for col in market_cols:
+    for col in MARKET_COLS:
         if col in df.columns:
             print(f"\n{col}:")
             print(df[col].head())
@@ -238,6 +250,12 @@ def main():
             print(f"\n{col} not found in DataFrame")
 
 if __name__ == "__main__":
+    # Set up logging (only when run as a script, so importing this module has no side effects)
+    logging.basicConfig(
+        filename='market_stats.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     try:
         main()
     except Exception as e:
@@ -2,71 +2,344 @@
 import warnings
 warnings.filterwarnings('ignore')
 
+import numpy as np
 import pandas as pd
 import os
+import re
+import sys
+import json
+import hashlib
+import shelve
+import shutil
 import argparse
+import faiss
+from faiss.contrib.inspect_tools import get_invlist
+from functools import lru_cache
 from openai import OpenAI
 from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from langchain_openai import ChatOpenAI
 from langchain_core.documents import Document
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-def create_document(row):
-    """Create a Document object from a DataFrame row."""
-    content = f"Type: {row['type']}\n"
-    content += f"Period: {row['start_date']} to {row['end_date']}\n"
-    content += f"Ticker: {row['ticker']}\n"
-    content += f"Growth (last day): {row['growth_last_day']:.2%}\n"
-    content += f"Weekly Return: {row['weekly_return']:.2%}\n"
-    content += f"Market Daily Return: {row['market_daily_return']:.2%}\n"
-    content += f"Market Weekly Return: {row['market_weekly_return']:.2%}\n"
-    content += f"Growth Above Market: {row['growth_above_market']:.2%}\n"
-    content += f"Count: {row['count']}\n"
-    content += f"Content: {row['text']}"
-    
-    return Document(
-        page_content=content,
-        metadata={
-            'type': row['type'],
-            'ticker': row['ticker'],
-            'link': row['link'],
-            'start_date': str(row['start_date']),
-            'end_date': str(row['end_date']),
-            'weekly_return': row['weekly_return'],
-            'market_daily_return': row['market_daily_return'],
-            'market_weekly_return': row['market_weekly_return'],
-            'growth_above_market': row['growth_above_market']
-        }
+# Configuration
+DATA_FILE_PATH = 'data/news_feed_with_market_stats.parquet'
+FAISS_CACHE_DIR = 'data/faiss_cache'  # One subdirectory per (embedding model, splitter, index settings)
+EMBEDDING_MODEL = 'text-embedding-3-small'  # Cheaper than ada-002 at the same 1536 dimensions
+EMBEDDING_BATCH_SIZE = 1000  # Texts sent per embeddings request
+EMBEDDING_MAX_RETRIES = 6
+QUERY_CACHE_SIZE = 128  # Query embeddings kept in memory
+QUERY_CACHE_PATH = 'data/query_embeddings.db'  # Query embeddings per (embedding model, query)
+LLM_MODEL = 'gpt-4o-mini'  # Default answer model, override with --model
+MAX_ANSWER_TOKENS = 1500
+SOURCES_K = 7  # Documents retrieved as context for the answer
+TICKER_PATTERN = re.compile(r'(\$?)\b([A-Z]{2,5})\b')  # Ticker-like words in the question, optionally $-prefixed
+# Upper-case acronyms that questions use as words even where a ticker has that symbol; write $AI for the ticker
+NON_TICKER_WORDS = {
+    'AI', 'US', 'USA', 'UK', 'EU', 'CEO', 'CFO', 'CTO', 'IPO', 'ETF', 'EV', 'GDP',
+    'CPI', 'PPI', 'FED', 'FOMC', 'SEC', 'EPS', 'ESG', 'IT', 'API'
+}
+TEXT_COLUMNS = ['type', 'start_date', 'end_date', 'ticker', 'count', 'text']
+PERCENT_COLUMNS = [
+    'growth_last_day', 'weekly_return', 'market_daily_return',
+    'market_weekly_return', 'growth_above_market'
+]
+METADATA_COLUMNS = [
+    'type', 'ticker', 'link', 'start_date', 'end_date', 'weekly_return',
+    'market_daily_return', 'market_weekly_return', 'growth_above_market'
+]
+# Columns read from the data file to build the documents
+DOCUMENT_COLUMNS = list(dict.fromkeys(TEXT_COLUMNS + PERCENT_COLUMNS + METADATA_COLUMNS))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# HNSW graph index for small corpora: approximate search that visits a small part of it per query
+HNSW_M = 32  # Neighbours per vector in the graph
+HNSW_EF_CONSTRUCTION = 200  # Candidate list size while building, higher gives a better graph
+HNSW_EF_SEARCH = 64  # Candidate list size while searching, higher gives better recall
+# Product-quantized index for large corpora: OPQ rotation to 128 dims, 256 inverted lists and
+# 32-byte codes instead of 6 KB float vectors; used once there is enough data to train it
+PQ_INDEX_FACTORY = 'OPQ32_128,IVF256,PQ32'
+PQ_MIN_TRAINING_VECTORS = 39 * 256  # faiss needs ~39 training vectors per inverted list
+IVF_NPROBE = 16  # Inverted lists scanned per query, higher gives better recall
+# Cosine similarity: vectors are L2-normalized and compared by inner product
+VECTORSTORE_KWARGS = {'normalize_L2': True, 'distance_strategy': DistanceStrategy.MAX_INNER_PRODUCT}
+
+def create_documents(df):
+    """Create Document objects from all DataFrame rows at once."""
+    # Same text as formatting each row value with str() / {:.2%}, built column by column
+    text = df[TEXT_COLUMNS].astype(object).map(str)
+    percent = pd.DataFrame(
+        np.char.mod('%.2f%%', df[PERCENT_COLUMNS].to_numpy(dtype=np.float64) * 100),
+        index=df.index,
+        columns=PERCENT_COLUMNS
+    )
+    content = (
+        "Type: " + text['type'] + "\n"
+        + "Period: " + text['start_date'] + " to " + text['end_date'] + "\n"
+        + "Ticker: " + text['ticker'] + "\n"
+        + "Growth (last day): " + percent['growth_last_day'] + "\n"
+        + "Weekly Return: " + percent['weekly_return'] + "\n"
+        + "Market Daily Return: " + percent['market_daily_return'] + "\n"
+        + "Market Weekly Return: " + percent['market_weekly_return'] + "\n"
+        + "Growth Above Market: " + percent['growth_above_market'] + "\n"
+        + "Count: " + text['count'] + "\n"
+        + "Content: " + text['text']
+    )
+    
+    metadatas = (
+        df[METADATA_COLUMNS]
+        .assign(start_date=text['start_date'], end_date=text['end_date'])
+        .to_dict(orient='records')
     )
+    return [
+        Document(page_content=page_content, metadata=metadata)
+        for page_content, metadata in zip(content, metadatas)
+    ]
+
+# Text splitter, built once and reused for every indexing run
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len
+)
+
+def split_documents(documents):
+    """Split long documents into chunks for embedding; short ones are kept whole."""
+    # Documents that fit in one chunk would come back from the splitter unchanged
+    short_documents = [doc for doc in documents if len(doc.page_content) <= CHUNK_SIZE]
+    long_documents = [doc for doc in documents if len(doc.page_content) > CHUNK_SIZE]
+    return short_documents + TEXT_SPLITTER.split_documents(long_documents)
+
+def faiss_cache_path():
+    """Get the cache directory of the FAISS index for the current settings."""
+    settings = json.dumps([
+        EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP,
+        HNSW_M, HNSW_EF_CONSTRUCTION, PQ_INDEX_FACTORY, PQ_MIN_TRAINING_VECTORS
+    ])
+    return os.path.join(FAISS_CACHE_DIR, hashlib.sha1(settings.encode()).hexdigest()[:16])
+
+class QueryCachedEmbeddings(Embeddings):
+    """Embeddings wrapper that embeds each distinct query only once, also across runs."""
+    
+    def __init__(self, embeddings, model, cache_path=QUERY_CACHE_PATH):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache_path = cache_path
+        self._embed_query = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._embed_query_with_disk_cache)
+    
+    def _embed_query_with_disk_cache(self, text):
+        key = f"{self.model}:{hashlib.sha1(text.encode()).hexdigest()}"
+        with shelve.open(self.cache_path) as cache:
+            if key not in cache:
+                cache[key] = self.embeddings.embed_query(text)
+            return cache[key]
+    
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text):
+        return self._embed_query(text)
 
-def setup_qa_chain(documents):
-    """Set up the QA chain with the given documents."""
-    # Initialize text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
+def create_embeddings():
+    """Create the OpenAI embeddings client used for both indexing and queries."""
+    return QueryCachedEmbeddings(OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        show_progress_bar=True
+    ), EMBEDDING_MODEL)
+
+def set_search_params(index):
+    """Set the query-time recall/speed parameters of an HNSW or IVF index."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+
+def create_vectorstore(embeddings, vectors):
+    """Create an empty vector store with an index suited to the number of vectors.
+
+    Small corpora get an HNSW graph over the full vectors; corpora large enough to train
+    product quantization get a compressed OPQ/IVF/PQ index trained on the given vectors.
+    Both compare L2-normalized vectors by inner product.
+    """
+    dimension = len(vectors[0])
+    if len(vectors) >= PQ_MIN_TRAINING_VECTORS:
+        index = faiss.index_factory(dimension, PQ_INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        training_vectors = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(training_vectors)
+        index.train(training_vectors)
+    else:
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    set_search_params(index)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        **VECTORSTORE_KWARGS
+    )
+
+def add_splits(vectorstore, splits, embeddings):
+    """Embed the splits in batched requests and add them to the vector store (created if None).
+
+    Returns the vector store and the docstore ids of the splits.
+    """
+    texts = [doc.page_content for doc in splits]
+    metadatas = [doc.metadata for doc in splits]
+    vectors = embeddings.embed_documents(texts)
+    if vectorstore is None:
+        vectorstore = create_vectorstore(embeddings, vectors)
+    doc_ids = vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+    return vectorstore, doc_ids
+
+def copy_vectorstore(vectorstore, embeddings, doc_ids):
+    """Build a new vector store of the given documents from the vectors stored in the vector store.
+
+    Returns None if there are no documents.
+    """
+    if not doc_ids:
+        return None
+    positions = {doc_id: position for position, doc_id in vectorstore.index_to_docstore_id.items()}
+    documents = [vectorstore.docstore.search(doc_id) for doc_id in doc_ids]
+    
+    # IVF indexes give back (approximate, decoded) vectors only through a direct map
+    index = vectorstore.index
+    if not isinstance(index, faiss.IndexHNSW):
+        faiss.extract_index_ivf(index).make_direct_map()
+    vectors = index.reconstruct_batch(np.array([positions[doc_id] for doc_id in doc_ids], dtype=np.int64))
+    
+    copy = create_vectorstore(embeddings, vectors)
+    copy.add_embeddings(
+        [(document.page_content, vector) for document, vector in zip(documents, vectors)],
+        metadatas=[document.metadata for document in documents],
+        ids=doc_ids
     )
+    return copy
+
+def remove_documents(vectorstore, embeddings, doc_ids):
+    """Remove the given documents from the vector store.
+
+    IVF indexes remove the vectors in place, keeping their trained quantizers; HNSW indexes
+    cannot remove vectors, so they are rebuilt from the vectors of the remaining documents.
+    Returns the vector store, or None if no documents remain.
+    """
+    removed_ids = set(doc_ids)
+    kept_positions = [
+        position for position, doc_id in sorted(vectorstore.index_to_docstore_id.items())
+        if doc_id not in removed_ids
+    ]
+    if not kept_positions:
+        return None
+    if isinstance(vectorstore.index, faiss.IndexHNSW):
+        kept_ids = [vectorstore.index_to_docstore_id[position] for position in kept_positions]
+        return copy_vectorstore(vectorstore, embeddings, kept_ids)
+    
+    ivf = faiss.extract_index_ivf(vectorstore.index)
+    ivf.make_direct_map(False)  # Vectors cannot be removed through an array direct map
+    vectorstore.delete(list(removed_ids))
+    
+    # delete() renumbers the remaining documents to consecutive positions, but the inverted
+    # lists keep the old labels of their vectors: renumber those the same way
+    kept_positions = np.array(kept_positions, dtype=np.int64)
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        list_size = invlists.list_size(list_no)
+        if list_size:
+            labels, codes = get_invlist(invlists, list_no)
+            new_labels = np.searchsorted(kept_positions, labels).astype(np.int64)
+            invlists.update_entries(
+                list_no, 0, list_size, faiss.swig_ptr(new_labels), faiss.swig_ptr(np.ascontiguousarray(codes))
+            )
+    return vectorstore
+
+def document_hash(document):
+    """Hash a news document, which changes whenever the news item or its market stats change."""
+    return hashlib.sha1((document.metadata['link'] + document.page_content).encode()).hexdigest()
+
+def load_vectorstore(embeddings):
+    """Load the cached FAISS index of all news, embedding only news added or changed since.
+
+    Returns None if there is no news to index.
+    """
+    cache_path = faiss_cache_path()
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    data_mtime = os.path.getmtime(DATA_FILE_PATH)
+    
+    vectorstore, indexed = None, {}  # document hash -> docstore ids of its chunks
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        vectorstore = FAISS.load_local(
+            cache_path, embeddings, allow_dangerous_deserialization=True, **VECTORSTORE_KWARGS
+        )
+        set_search_params(vectorstore.index)
+        indexed = manifest['documents']
+        if manifest['data_mtime'] == data_mtime:
+            print(f"Loaded cached FAISS index from {cache_path}")
+            return vectorstore
     
-    # Split documents
-    splits = text_splitter.split_documents(documents)
+    df = pd.read_parquet(DATA_FILE_PATH, engine='pyarrow', columns=DOCUMENT_COLUMNS)
+    documents = {}  # document hash -> documents (repeated rows give the same document)
+    for document in create_documents(df):
+        documents.setdefault(document_hash(document), []).append(document)
     
-    # Initialize embeddings and vector store
-    embeddings = OpenAIEmbeddings()
-    vectorstore = FAISS.from_documents(splits, embeddings)
+    # News items that were dropped or changed leave the index; the rest keep their vectors
+    stale_hashes = indexed.keys() - documents.keys()
+    if stale_hashes:
+        stale_ids = [doc_id for content_hash in stale_hashes for doc_id in indexed.pop(content_hash)]
+        vectorstore = remove_documents(vectorstore, embeddings, stale_ids)
     
-    # Initialize LLM
-    llm = ChatOpenAI(model_name="gpt-4", temperature=0)
+    # Embed only the news items that are not in the index yet
+    new_hashes = [content_hash for content_hash in documents if content_hash not in indexed]
+    print(f"Indexing {sum(len(documents[content_hash]) for content_hash in new_hashes)} of {len(df)} news items")
+    if new_hashes:
+        split_hashes, splits = [], []
+        for content_hash in new_hashes:
+            for split in split_documents(documents[content_hash]):
+                split_hashes.append(content_hash)
+                splits.append(split)
+        vectorstore, doc_ids = add_splits(vectorstore, splits, embeddings)
+        for content_hash, doc_id in zip(split_hashes, doc_ids):
+            indexed.setdefault(content_hash, []).append(doc_id)
     
-    # Create prompt template
-    prompt = PromptTemplate(
-        template="""You are a financial news analyst assistant. Your task is to provide accurate, 
+    if vectorstore is None:
+        print(f"No news to index in {DATA_FILE_PATH}")
+        shutil.rmtree(cache_path, ignore_errors=True)
+        return None
+    
+    vectorstore.save_local(cache_path)
+    with open(manifest_path, 'w') as f:
+        json.dump({'data_mtime': data_mtime, 'documents': indexed}, f)
+    return vectorstore
+
+def ticker_vectorstore(vectorstore, embeddings, tickers):
+    """Build an in-memory index of the given tickers' news from the vectors stored in the full index.
+
+    Returns None if the full index holds no news about the tickers.
+    """
+    doc_ids = [
+        doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+        if vectorstore.docstore.search(doc_id).metadata['ticker'] in tickers
+    ]
+    return copy_vectorstore(vectorstore, embeddings, doc_ids)
+
+def find_tickers(question, known_tickers):
+    """Find the tickers from the dataset that the question mentions."""
+    words = {word for dollar, word in TICKER_PATTERN.findall(question) if dollar or word not in NON_TICKER_WORDS}
+    return sorted(words & known_tickers)
+
+# Prompt template, built and validated once at import
+PROMPT = PromptTemplate(
+    template="""You are a financial news analyst assistant. Your task is to provide accurate, 
                 well-structured responses based on the provided news articles context. Present the 
                 information in chronological order, from earliest to most recent events.
 
@@ -105,24 +378,51 @@ def setup_qa_chain(documents):
                 Context: {context}
 
                 Answer: Let's analyze this based on the provided information.""",
-        input_variables=["context", "question"]
-    )
-    
-    # Create and return chain
-    chain = (
-        {"context": vectorstore.as_retriever(search_kwargs={"k": 7}), "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    input_variables=["context", "question"]
+)
+
+def make_llm(model=LLM_MODEL):
+    """Create the streaming chat model that writes the answer."""
+    return ChatOpenAI(model=model, temperature=0, max_tokens=MAX_ANSWER_TOKENS, streaming=True)
+
+def setup_qa_chain(model=LLM_MODEL):
+    """Set up the QA chain that answers from the retrieved documents."""
+    # The chain takes the retrieved documents as context, so the query is only searched once
+    return PROMPT | make_llm(model) | StrOutputParser()
+
+def retrieve_sources(vectorstore, embeddings, query):
+    """Retrieve the source documents for the query."""
+    # The query embedding comes from the cache when the question was asked before
+    query_vector = embeddings.embed_query(query)
+    return vectorstore.similarity_search_by_vector(query_vector, k=SOURCES_K)
+
+def print_header(sources):
+    """Print the analysis header with the period covered by the source documents."""
+    # Calculate date range from relevant documents
+    dates = [(doc.metadata['start_date'], doc.metadata['end_date']) for doc in sources]
+    min_date = min(date[0] for date in dates)
+    max_date = max(date[1] for date in dates)
+    weeks = round((pd.to_datetime(max_date) - pd.to_datetime(min_date)).days / 7)
     
-    return chain, vectorstore.as_retriever(search_kwargs={"k": 7})
+    # Determine if this is a ticker-specific analysis
+    ticker_sources = [doc for doc in sources if doc.metadata['type'] == 'individual']
+    if ticker_sources:
+        # Get the most common ticker from individual sources
+        tickers = [doc.metadata['ticker'] for doc in ticker_sources]
+        if tickers:
+            most_common_ticker = max(set(tickers), key=tickers.count)
+            print(f"\nLong term news for {most_common_ticker} in the last {weeks} weeks ({min_date}..{max_date}):\n")
+        else:
+            print(f"\nAnalysis for the last {weeks} weeks ({min_date}..{max_date}):\n")
+    else:
+        print(f"\nAnalysis for the last {weeks} weeks ({min_date}..{max_date}):\n")
 
-def get_response(chain, retriever, query):
-    """Get response using the RAG chain."""
-    response = chain.invoke(query)
-    sources = retriever.invoke(query)
-    return response, sources
+def stream_response(chain, sources, query):
+    """Stream the answer based on the sources to stdout."""
+    for chunk in chain.stream({"context": sources, "question": query}):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
 
 def print_sources(sources):
     """Print source documents in a formatted way."""
@@ -137,11 +437,52 @@ def print_sources(sources):
         print(f"Market Weekly Return: {doc.metadata['market_weekly_return']:.2%}")
         print(f"Growth Above Market: {doc.metadata['growth_above_market']:.2%}")
 
+def answer_question(chain, vectorstores, embeddings, known_tickers, question, show_sources=True):
+    """Answer one question: retrieve its sources, stream the answer and print the sources.
+
+    vectorstores maps ticker tuples (empty for all news) to the indexes built so far.
+    """
+    # Restrict the search to the tickers mentioned in the question, if any
+    tickers = find_tickers(question, known_tickers)
+    if tickers:
+        print(f"Searching news for {', '.join(tickers)}")
+    
+    # Ticker questions search an index of only those tickers' news, built from the full index's
+    # vectors so that no news is embedded twice
+    if () not in vectorstores:
+        vectorstores[()] = load_vectorstore(embeddings)
+    if vectorstores[()] is None:
+        return
+    scope = tuple(tickers)
+    if scope not in vectorstores:
+        vectorstores[scope] = ticker_vectorstore(vectorstores[()], embeddings, tickers)
+    vectorstore = vectorstores[scope]
+    if vectorstore is None:
+        print(f"No news about {', '.join(tickers)} found, searching all news")
+        vectorstore = vectorstores[()]
+    
+    # Retrieve the sources and stream the response
+    sources = retrieve_sources(vectorstore, embeddings, question)
+    if not sources:
+        print("No news found for the question")
+        return
+    print_header(sources)
+    stream_response(chain, sources, question)
+    
+    # Print sources if requested
+    if show_sources:
+        print_sources(sources)
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze financial news based on your question')
-    parser.add_argument('question', help='Question to analyze (e.g., "What are the latest developments for NVDA?")')
+    parser.add_argument('question', nargs='?', help='Question to analyze (e.g., "What are the latest developments for NVDA?")')
     parser.add_argument('--show_sources', help='Show source documents (optional)', type=lambda x: x.lower() == 'true', default=True)
+    parser.add_argument('--model', help=f'OpenAI chat model for the answer (default: {LLM_MODEL})', default=LLM_MODEL)
+    parser.add_argument('--interactive', action='store_true',
+                        help='Keep the index loaded and answer questions typed one after another')
     args = parser.parse_args()
+    if not args.question and not args.interactive:
+        parser.error('a question is required unless --interactive is given')
 
     # Load environment variables
     load_dotenv()
@@ -149,42 +490,27 @@ def main():
     # Initialize OpenAI client
     client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
     
-    # Load the data
-    df = pd.read_parquet('data/news_feed_with_market_stats.parquet')
-    
-    # Create documents from all data
-    documents = [create_document(row) for _, row in df.iterrows()]
+    # Vector stores are loaded per question, (re)indexing the data only where it changed
+    embeddings = create_embeddings()
+    vectorstores = {}
+    known_tickers = set(pd.read_parquet(DATA_FILE_PATH, engine='pyarrow', columns=['ticker'])['ticker'])
     
     # Setup chain
-    chain, retriever = setup_qa_chain(documents)
+    chain = setup_qa_chain(model=args.model)
     
-    # Get response
-    response, sources = get_response(chain, retriever, args.question)
+    if args.question:
+        answer_question(chain, vectorstores, embeddings, known_tickers, args.question, args.show_sources)
     
-    # Calculate date range from relevant documents
-    dates = [(doc.metadata['start_date'], doc.metadata['end_date']) for doc in sources]
-    min_date = min(date[0] for date in dates)
-    max_date = max(date[1] for date in dates)
-    weeks = round((pd.to_datetime(max_date) - pd.to_datetime(min_date)).days / 7)
-    
-    # Determine if this is a ticker-specific analysis
-    ticker_sources = [doc for doc in sources if doc.metadata['type'] == 'individual']
-    if ticker_sources:
-        # Get the most common ticker from individual sources
-        tickers = [doc.metadata['ticker'] for doc in ticker_sources]
-        if tickers:
-            most_common_ticker = max(set(tickers), key=tickers.count)
-            print(f"\nLong term news for {most_common_ticker} in the last {weeks} weeks ({min_date}..{max_date}):\n")
-        else:
-            print(f"\nAnalysis for the last {weeks} weeks ({min_date}..{max_date}):\n")
-    else:
-        print(f"\nAnalysis for the last {weeks} weeks ({min_date}..{max_date}):\n")
-    
-    print(response)
-    
-    # Print sources if requested
-    if args.show_sources:
-        print_sources(sources)
+    if args.interactive:
+        # Answer further questions with the same indexes and chain until an empty line or EOF
+        while True:
+            try:
+                question = input("\nQuestion (empty line to quit): ").strip()
+            except (EOFError, KeyboardInterrupt):
+                break
+            if not question:
+                break
+            answer_question(chain, vectorstores, embeddings, known_tickers, question, args.show_sources)
 
 if __name__ == "__main__":
     main()